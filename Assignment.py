@@ -2,15 +2,31 @@
 # Original code by Håkon Måløy
 # Updated by Xavier Sánchez Díaz
 
-import copy
-from itertools import product as prod
+from collections import deque
+
+# The values of an empty Sudoku cell
+SUDOKU_DIGITS = tuple(str(digit) for digit in range(1, 10))
+
+# Marks an arc (i, j) whose only constraint is i != j, see CSP.revise
+NOT_EQUAL = object()
+
+
+def bits(mask: int):
+    """Iterate over the single-bit masks set in 'mask', lowest first."""
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
 
-global backtrack_call_count
-backtrack_call_count = 0
-global failure_count
-failure_count = 0
 
 class CSP:
+    __slots__ = ('variables', 'domains', 'pruned_domains', 'constraints',
+                 'neighbors',
+                 'values', 'value_bits', 'alldiff_groups', 'compat',
+                 'index', 'nbr_ptr', 'nbr_idx', 'arc_var', 'arc_compat',
+                 'arc_reverse', 'alldiff_idx', 'backtrack_call_count',
+                 'failure_count')
+
     def __init__(self):
         # self.variables is a list of the variable names in the CSP
         self.variables = []
@@ -18,42 +34,113 @@ class CSP:
         # self.domains is a dictionary of domains (lists)
         self.domains = {}
 
-        # self.constraints[i][j] is a list of legal value pairs for
-        # the variable pair (i, j)
+        # self.pruned_domains is a copy of self.domains, from which the
+        # values ruled out while adding constraints are removed. The
+        # solver starts from these, while self.domains keeps the
+        # problem as it was given.
+        self.pruned_domains = {}
+
+        # self.constraints[i][j] is a dictionary mapping every legal
+        # value of i to the set of legal values of j for the variable
+        # pair (i, j)
         self.constraints = {}
 
+        # self.neighbors[i] is a list of the variables that share a
+        # constraint with variable i
+        self.neighbors = {}
+
+        # self.values is a list of all the values in any domain, and
+        # self.value_bits[v] is the single-bit mask of value v, where
+        # value self.values[k] is bit k. Domains are encoded as the OR
+        # of the bits of their values during the search.
+        self.values = []
+        self.value_bits = {}
+
+        # self.alldiff_groups is a list of the lists of variables given
+        # to add_all_different_constraint
+        self.alldiff_groups = []
+
+        # self.compat[i][j] maps the bit of every legal value of i to
+        # the mask of legal values of j, or is NOT_EQUAL for arcs that
+        # only come from an Alldiff constraint
+        self.compat = {}
+
+        # The flat lists below are built by self.compile(), and are
+        # what the solver works on:
+        # self.index[i] is the index of variable i in self.variables.
+        # The arcs from variable k are numbered from self.nbr_ptr[k] to
+        # self.nbr_ptr[k + 1] - 1, and arc a goes from variable
+        # self.arc_var[a] to variable self.nbr_idx[a], with the compat
+        # table self.arc_compat[a]. self.arc_reverse[a] is the arc going
+        # the other way, and self.alldiff_idx holds self.alldiff_groups
+        # as lists of indices.
+        self.index = {}
+        self.nbr_ptr = []
+        self.nbr_idx = []
+        self.arc_var = []
+        self.arc_compat = []
+        self.arc_reverse = []
+        self.alldiff_idx = []
+
+        # The number of calls to, and failures in, 'backtrack', counted
+        # over all searches of this CSP
+        self.backtrack_call_count = 0
+        self.failure_count = 0
+
     def add_variable(self, name: str, domain: list):
         """Add a new variable to the CSP.
 
         Parameters
         ----------
         name : str
-            The name of the variable to add
+            The name of the variable to add, which may be any hashable
+            value, such as a tuple
         domain : list
             A list of the legal values for the variable
         """
         self.variables.append(name)
         self.domains[name] = list(domain)
+        self.pruned_domains[name] = list(domain)
         self.constraints[name] = {}
+        self.neighbors[name] = []
+        self.compat[name] = {}
+        for value in domain:
+            if value not in self.value_bits:
+                self.value_bits[value] = 1 << len(self.values)
+                self.values.append(value)
 
-    def get_all_possible_pairs(self, a: list, b: list) -> list[tuple]:
-        """Get a list of all possible pairs (as tuples) of the values in
-        lists 'a' and 'b', where the first component comes from list
-        'a' and the second component comes from list 'b'.
+    def encode(self, values: list) -> int:
+        """Encode a list of domain values as a bitmask.
 
         Parameters
         ----------
-        a : list
-            First list of values
-        b : list
-            Second list of values
+        values : list
+            A list of values which are in the domain of some variable
 
         Returns
         -------
-        list[tuple]
-            List of tuples in the form (a, b)
+        int
+            The OR of the bits of the values
+        """
+        mask = 0
+        for value in values:
+            mask |= self.value_bits[value]
+        return mask
+
+    def decode(self, mask: int) -> list:
+        """Decode a bitmask into the list of domain values it holds.
+
+        Parameters
+        ----------
+        mask : int
+            A bitmask as returned by 'encode'
+
+        Returns
+        -------
+        list
+            The values whose bits are set in 'mask'
         """
-        return prod(a, b)
+        return [self.values[bit.bit_length() - 1] for bit in bits(mask)]
 
     def get_all_arcs(self) -> list[tuple]:
         """Get a list of all arcs/constraints that have been defined in
@@ -80,7 +167,7 @@ class CSP:
         list[tuple]
             A list of all arcs/constraints in which `var` is involved
         """
-        return [(i, var) for i in self.constraints[var]]
+        return [(i, var) for i in self.neighbors[var]]
 
     def add_constraint_one_way(self, i: str, j: str,
                                filter_function: callable):
@@ -106,17 +193,55 @@ class CSP:
             keep away those that don't pass your filter.
         """
         if j not in self.constraints[i]:
-            # First, get a list of all possible pairs of values
-            # between variables i and j
-            self.constraints[i][j] = self.get_all_possible_pairs(
-                self.domains[i], self.domains[j])
-
-        # Next, filter this list of value pairs through the function
-        # 'filter_function', so that only the legal value pairs remain
-        self.constraints[i][j] = list(filter(lambda
-                                             value_pair:
-                                             filter_function(*value_pair),
-                                             self.constraints[i][j]))
+            # First, consider all possible pairs of values between
+            # variables i and j
+            candidates = {x: self.pruned_domains[j]
+                          for x in self.pruned_domains[i]}
+            self.neighbors[i].append(j)
+        else:
+            # Otherwise, start from the value pairs which are already legal
+            candidates = self.constraints[i][j]
+
+        # Next, filter these value pairs through the function
+        # 'filter_function', so that only the legal value pairs remain,
+        # and index them by the value of i
+        mapping = {}
+        for x, ys in candidates.items():
+            supports = {y for y in ys if filter_function(x, y)}
+            if supports:
+                mapping[x] = supports
+        self.constraints[i][j] = mapping
+        self.compat[i][j] = {self.value_bits[x]: self.encode(ys)
+                             for x, ys in mapping.items()}
+
+        # If i already has a single value, prune j right away, so that
+        # AC-3 does not have to rediscover it when solving
+        self._fold_singleton(i, j)
+
+    def _fold_singleton(self, i: str, j: str):
+        """If variable 'i' has a single value in its pruned domain, remove
+        the values from the pruned domain of 'j' that are not legal
+        partners of it. If 'j' is left with a single value, this is
+        repeated for all of the constraints from 'j'. If 'j' is left
+        without any value, its pruned domain is left empty, and
+        'backtracking_search' returns False without searching.
+
+        Parameters
+        ----------
+        i : str
+            Name of the first variable
+        j : str
+            Name of the second variable
+        """
+        if len(self.pruned_domains[i]) != 1:
+            return
+        supports = self.constraints[i][j].get(self.pruned_domains[i][0], ())
+        domain = [y for y in self.pruned_domains[j] if y in supports]
+        if len(domain) != len(self.pruned_domains[j]):
+            self.pruned_domains[j] = domain
+            if len(domain) == 1:
+                for k in self.neighbors[j]:
+                    self._fold_singleton(j, k)
 
     def add_all_different_constraint(self, var_list: list):
         """Add an Alldiff constraint between all of the variables in the
@@ -127,148 +252,502 @@ class CSP:
         var_list : list
             A list of variable names
         """
-        for (i, j) in self.get_all_possible_pairs(var_list, var_list):
-            if i != j:
-                self.add_constraint_one_way(i, j, lambda x, y: x != y)
-
-    def backtracking_search(self):
+        self.alldiff_groups.append(list(dict.fromkeys(var_list)))
+
+        # All of the arcs share one mapping from every value to all of
+        # the other values found in the domains of the variables
+        values = {x for var in var_list for x in self.pruned_domains[var]}
+        not_equal = {x: values - {x} for x in values}
+        for i in var_list:
+            for j in var_list:
+                if i == j:
+                    continue
+                if j in self.constraints[i]:
+                    # Combine with the constraint that is already there,
+                    # unless it is i != j from another Alldiff constraint
+                    if self.compat[i][j] is not NOT_EQUAL:
+                        self.add_constraint_one_way(i, j, lambda x, y: x != y)
+                    continue
+                # Arcs without any other constraint can use the
+                # specialized check for i != j
+                self.neighbors[i].append(j)
+                self.constraints[i][j] = not_equal
+                self.compat[i][j] = NOT_EQUAL
+                self._fold_singleton(i, j)
+
+    def compile(self):
+        """Freeze the structure of the CSP into flat lists indexed by
+        integers, which the solver works on. Variable k is
+        self.variables[k], and the arcs from every variable are numbered
+        consecutively, so that the arcs from variable k are the range
+        self.nbr_ptr[k] to self.nbr_ptr[k + 1].
+
+        This is called by 'backtracking_search', so it only needs to be
+        called directly to inspect the compiled CSP.
+        """
+        self.index = {var: k for k, var in enumerate(self.variables)}
+        self.nbr_ptr = [0]
+        self.nbr_idx = []
+        self.arc_var = []
+        self.arc_compat = []
+        for k, var in enumerate(self.variables):
+            for neighbor in self.neighbors[var]:
+                self.nbr_idx.append(self.index[neighbor])
+                self.arc_var.append(k)
+                self.arc_compat.append(self.compat[var][neighbor])
+            self.nbr_ptr.append(len(self.nbr_idx))
+
+        # Find the arc (j, i) going the other way for every arc (i, j)
+        arc_ids = {(i, j): arc for arc, (i, j)
+                   in enumerate(zip(self.arc_var, self.nbr_idx))}
+        self.arc_reverse = [arc_ids[j, i] for i, j
+                            in zip(self.arc_var, self.nbr_idx)]
+
+        self.alldiff_idx = [[self.index[var] for var in group]
+                            for group in self.alldiff_groups]
+
+    def backtracking_search(self, ac4: bool = False):
         """This functions starts the CSP solver and returns the found
         solution.
-        """
-        # Make a so-called "deep copy" of the dictionary containing the
-        # domains of the CSP variables. The deep copy is required to
-        # ensure that any changes made to 'assignment' does not have any
-        # side effects elsewhere, so that we can have a clean run for every recursion.
-        assignment = copy.deepcopy(self.domains)
-
-        # Run AC-3 on all constraints in the CSP, to weed out all of the
-        # values that are not arc-consistent to begin with
-        self.inference(assignment, self.get_all_arcs())
 
-        # Call backtrack with the partial assignment 'assignment'
-        return self.backtrack(assignment)
-
-    def backtrack(self, assignment: dict[str, list[str]]):
+        Parameters
+        ----------
+        ac4 : bool, optional
+            If True, the initial propagation over all constraints uses
+            AC-4 instead of AC-3, by default False
+        """
+        self.compile()
+
+        # Encode every pruned domain as a bitmask, in the order of
+        # self.variables. Integers are immutable, so any changes made to
+        # 'assignment' does not have any side effects on the CSP itself.
+        assignment = [self.encode(self.pruned_domains[var])
+                      for var in self.variables]
+        # A variable without any legal value can never be assigned
+        if not all(assignment):
+            return False
+
+        # Run AC-3 (or AC-4) on all constraints in the CSP, to weed out
+        # all of the values that are not arc-consistent to begin with
+        if ac4:
+            consistent = self._ac4_inference(assignment)
+        else:
+            consistent = self.inference(assignment,
+                                        range(len(self.nbr_idx)))
+        if consistent is False:
+            return False
+
+        # Call backtrack with the partial assignment 'assignment', and
+        # decode the solution back into lists of values
+        solution = self.backtrack(assignment)
+        if solution is False:
+            return False
+        return {var: self.decode(solution[k])
+                for k, var in enumerate(self.variables)}
+
+    def backtrack(self, assignment: list[int]):
         """The function 'Backtrack' from the pseudocode in the
         textbook.
 
-        The function is called recursively, with a partial assignment of
-        values 'assignment'. 'assignment' is a dictionary that contains
-        a list of all legal values for the variables that have *not* yet
-        been decided, and a list of only a single value for the
-        variables that *have* been decided.
+        The function starts from a partial assignment of values
+        'assignment'. 'assignment' is a list with, for every variable
+        index, a bitmask of all legal values for the variables that have
+        *not* yet been decided, and a single bit for the variables that
+        *have* been decided.
 
-        When all of the variables in 'assignment' have lists of length
-        one, i.e. when all variables have been assigned a value, the
+        When all of the variables in 'assignment' have a single bit
+        set, i.e. when all variables have been assigned a value, the
         function should return 'assignment'. Otherwise, the search
         should continue. When the function 'inference' is called to run
-        the AC-3 algorithm, the lists of legal values in 'assignment'
-        should get reduced as AC-3 discovers illegal values.
-
-        IMPORTANT: For every iteration of the for-loop in the
-        pseudocode, you need to make a deep copy of 'assignment' into a
-        new variable before changing it. Every iteration of the for-loop
-        should have a clean slate and not see any traces of the old
-        assignments and inferences that took place in previous
-        iterations of the loop.
+        the AC-3 algorithm, the bitmasks in 'assignment' should get
+        reduced as AC-3 discovers illegal values.
+
+        Instead of recursing, the search keeps an explicit stack with a
+        frame for every decided variable. Instead of copying
+        'assignment', every domain that gets replaced is pushed onto a
+        trail as a tuple (variable, old domain). Every frame remembers
+        the length of the trail before its variable was assigned, so
+        that before trying the next value the trail is unwound to that
+        length, and the iteration starts from a clean slate without any
+        traces of the previous assignments and inferences.
         """
-        # Increment counter
-        global backtrack_call_count
-        backtrack_call_count += 1
-        # We need a new copy of the domain values for this round of recursion.
-        ass2 = copy.deepcopy(assignment)
-        # Return the domains if they are all single values.
-        # If this is satisfied, the solution has been found.
-        if all(map(lambda x : len(x) == 1, ass2.values())):
-            return ass2
-        key = self.select_unassigned_variable(ass2)
-        var = ass2[key]
-        var.sort()
-        for value in var:
-            # Clear out the domain values for our selected variable
-            ass2[key] = []
-            # Check whether value is a valid domain value for the variable
-            ass2[key].append(value)
-            inf = self.inference(ass2, self.get_all_neighboring_arcs(key))
-            # If value was valid, keep going with the domain of this variable set to only value
-            if inf:
-                res = self.backtrack(ass2)
-                # Res will be False if the backtracking was unsuccesful.
-                # If solution found, keep returning the solution:
-                if res:
-                    return res
-        # Failure. This will take us back to the previous backtrack, where we can attempt with a new domain value
-        global failure_count
-        failure_count += 1
-        return False
+        # A variable without any legal value can never be assigned
+        if not all(assignment):
+            return False
+        # The counters are kept in local variables during the search
+        backtrack_call_count = 0
+        failure_count = 0
+        trail = []
+        # Every frame is a tuple (variable, iterator over its values
+        # left to try, length of the trail before it was assigned, arcs
+        # from its neighbors)
+        stack = []
+        while True:
+            # Increment counter
+            backtrack_call_count += 1
+            # Return the domains if they are all single values.
+            # If this is satisfied, the solution has been found.
+            if all(domain and not domain & (domain - 1) for domain in assignment):
+                self.backtrack_call_count += backtrack_call_count
+                self.failure_count += failure_count
+                return assignment
+            key = self.select_unassigned_variable(assignment)
+            arcs = [self.arc_reverse[arc] for arc
+                    in range(self.nbr_ptr[key], self.nbr_ptr[key + 1])]
+            stack.append((key, iter(self.order_domain_values(key, assignment)),
+                          len(trail), arcs))
+            # Find the next value that is valid, going back to the
+            # previous variable whenever a variable runs out of values
+            while stack:
+                key, values, mark, arcs = stack[-1]
+                for value in values:
+                    # Undo every change made since the variable was assigned
+                    while len(trail) > mark:
+                        k, v = trail.pop()
+                        assignment[k] = v
+                    # Set the domain of our selected variable to only this value
+                    trail.append((key, assignment[key]))
+                    assignment[key] = value
+                    # Check whether value is a valid domain value for the variable
+                    if self.inference(assignment, arcs, trail):
+                        # If value was valid, keep going with the domain of this variable set to only value
+                        break
+                else:
+                    # Failure. This will take us back to the previous variable, where we can attempt with a new domain value
+                    failure_count += 1
+                    stack.pop()
+                    continue
+                break
+            else:
+                # Every value of the first variable failed, so there is
+                # no solution. Leave 'assignment' as it was given.
+                for k, v in reversed(trail):
+                    assignment[k] = v
+                self.backtrack_call_count += backtrack_call_count
+                self.failure_count += failure_count
+                return False
 
     def inference(
-            self, assignment: dict[list[str]],
-            queue: list[tuple[str]]):
+            self, assignment: list[int],
+            queue: list[int], trail: list[tuple] = None):
         """The function 'AC-3' from the pseudocode in the textbook.
         'assignment' is the current partial assignment, that contains
-        the lists of legal values for each undecided variable. 'queue'
-        is the initial queue of arcs that should be visited.
+        the bitmasks of legal values for each undecided variable.
+        'queue' is the initial queue of arcs that should be visited.
         Parameters
         ----------
-        assignment : dict[list[str]]
-            csp.domains
+        assignment : list[int]
+            csp.domains, encoded as bitmasks by variable index
 
-        queue : list[tuple[str]]
-            the initial queue of arcs that should be visited
+        queue : list[int]
+            the initial queue of arcs that should be visited, as arc
+            numbers from 'compile'
+
+        trail : list[tuple], optional
+            If given, every domain replaced by 'revise' is appended to
+            it as a tuple (variable, old domain)
 
         Returns
         -------
-        dict[list[str]]
+        list[int]
             assignment
         """
-        # Go through all arcs in queue, keep checking until the domains are valid,
-        # and are not changed by the revise function
-        while len(queue):
-            x_j, x_i = queue.pop(0)
-            assignment, revised = self.revise(assignment, x_i, x_j)
-            if revised:
-                # If no domain values for x_i satisfy the constraints, fail:
-                if not len(assignment[x_i]):
+        # This loop is the hot path of the solver, so the attributes and
+        # methods it uses are looked up once, outside of it
+        nbr_ptr, nbr_idx = self.nbr_ptr, self.nbr_idx
+        arc_var, arc_compat = self.arc_var, self.arc_compat
+        arc_reverse, revise = self.arc_reverse, self.revise
+        # Use a deque, so that taking the next arc is O(1), and flag the
+        # arcs in it, so that no arc is queued twice
+        queue = deque(queue)
+        in_queue = bytearray(len(nbr_idx))
+        for arc in queue:
+            in_queue[arc] = 1
+        popleft, append = queue.popleft, queue.append
+        while True:
+            # Go through all arcs in queue, keep checking until the domains are valid,
+            # and are not changed by the revise function
+            while queue:
+                # The arc (x_i, x_j) revises the domain of x_i against x_j
+                arc = popleft()
+                in_queue[arc] = 0
+                x_j = nbr_idx[arc]
+                # The support of every value of x_i against a != constraint is
+                # already known while x_j is undecided, so skip revising it
+                if arc_compat[arc] is NOT_EQUAL and assignment[x_j] & (assignment[x_j] - 1):
+                    continue
+                assignment, revised = revise(assignment, arc, trail)
+                if revised:
+                    x_i = arc_var[arc]
+                    # If no domain values for x_i satisfy the constraints, fail:
+                    if not assignment[x_i]:
+                        return False
+                    # Add the arcs from all other neighbors to the queue of arcs to visit
+                    for out in range(nbr_ptr[x_i], nbr_ptr[x_i + 1]):
+                        if nbr_idx[out] != x_j:
+                            arc = arc_reverse[out]
+                            if not in_queue[arc]:
+                                append(arc)
+                                in_queue[arc] = 1
+            # Once the arcs are consistent, reason about every Alldiff
+            # constraint as a whole, and start over with the arcs to the
+            # variables it changed
+            changed = self._propagate_all_different(assignment, trail)
+            if changed is False:
+                return False
+            if not changed:
+                return assignment
+            for x_i in changed:
+                for out in range(nbr_ptr[x_i], nbr_ptr[x_i + 1]):
+                    arc = arc_reverse[out]
+                    if not in_queue[arc]:
+                        append(arc)
+                        in_queue[arc] = 1
+
+    def _propagate_all_different(self, assignment: list[int],
+                                 trail: list[tuple] = None):
+        """Propagate every Alldiff constraint added with
+        'add_all_different_constraint' over its whole group of
+        variables, until none of these rules removes any more values:
+
+        - The values of the decided variables are removed from the
+          domains of the other variables.
+        - When two variables have the same two values left, these
+          values are removed from the domains of the other variables.
+        - When the group has exactly as many values as variables, every
+          value has to be used, so a value that is left in the domain
+          of a single variable is assigned to it.
+
+        Parameters
+        ----------
+        assignment : list[int]
+            csp.domains, encoded as bitmasks by variable index
+
+        trail : list[tuple], optional
+            If given, every domain replaced is appended to it as a tuple
+            (variable, old domain)
+
+        Returns
+        -------
+        set
+            The indices of the variables whose domains were changed, or
+            False if a constraint cannot be satisfied
+        """
+        changed = set()
+
+        def replace(var, domain):
+            if trail is not None:
+                trail.append((var, assignment[var]))
+            assignment[var] = domain
+            changed.add(var)
+
+        for group in self.alldiff_idx:
+            progress = True
+            while progress:
+                progress = False
+                # Remove the values of the decided variables
+                decided = 0
+                for var in group:
+                    domain = assignment[var]
+                    if domain & (domain - 1) == 0:
+                        if domain & decided:
+                            return False
+                        decided |= domain
+                # Find pairs of variables with the same two values, and
+                # the values which are left in one or more domains
+                first = {}
+                pairs = set()
+                once = twice = 0
+                for var in group:
+                    domain = assignment[var]
+                    if domain.bit_count() == 2:
+                        if first.setdefault(domain, var) != var:
+                            pairs.add(domain)
+                    twice |= once & domain
+                    once |= domain
+                paired = 0
+                for pair in pairs:
+                    paired |= pair
+                for var in group:
+                    domain = assignment[var]
+                    if domain & (domain - 1) == 0:
+                        continue
+                    revised_domain = domain & ~decided
+                    if domain not in pairs:
+                        revised_domain &= ~paired
+                    if revised_domain != domain:
+                        if not revised_domain:
+                            return False
+                        replace(var, revised_domain)
+                        progress = True
+                # Assign the values which are left for a single variable
+                size = once.bit_count()
+                if size < len(group):
                     return False
-                # Add all other neighbors to the queue of arcs to visit
-                for x_k in list(filter(lambda x: x_j not in x, self.get_all_neighboring_arcs(x_i))):
-                    queue.append(x_k)
-        return assignment
+                if size > len(group):
+                    continue
+                hidden = once & ~twice
+                for var in group:
+                    domain = assignment[var]
+                    value = domain & hidden
+                    if value and value != domain:
+                        if value & (value - 1):
+                            return False
+                        replace(var, value)
+                        progress = True
+        return changed
     
-    def select_unassigned_variable(self, assignment: dict[str,list[str]]) -> str:
+    def _ac4_inference(self, assignment: list[int]):
+        """The AC-4 algorithm, making all of the constraints in the CSP
+        arc-consistent. Instead of revising arcs, it counts for every
+        value a of every variable x_i how many values of each neighbor
+        x_j support it, and remembers which values (x_i, a) every value
+        (x_j, b) supports. When b is deleted, only the counters of the
+        values it supports are decremented, and a value is deleted when
+        one of its counters reaches zero.
+
+        Parameters
+        ----------
+        assignment : list[int]
+            csp.domains, encoded as bitmasks by variable index
+
+        Returns
+        -------
+        list[int]
+            assignment, or False if a domain was left empty
+        """
+        # counter[(arc, a)] is the number of supports of a in x_j for
+        # the arc (x_i, x_j), and supported[(x_j, b)] is a list of the
+        # (x_i, arc, a) that have b as a support
+        counter = {}
+        supported = {}
+        deleted = deque()
+
+        def delete(x_i, a):
+            assignment[x_i] &= ~a
+            deleted.append((x_i, a))
+            return assignment[x_i]
+
+        for arc, (x_i, x_j) in enumerate(zip(self.arc_var, self.nbr_idx)):
+            compat = self.arc_compat[arc]
+            for a in bits(assignment[x_i]):
+                if compat is NOT_EQUAL:
+                    supports = assignment[x_j] & ~a
+                else:
+                    supports = assignment[x_j] & compat.get(a, 0)
+                if not supports:
+                    if not delete(x_i, a):
+                        return False
+                    continue
+                counter[(arc, a)] = supports.bit_count()
+                for b in bits(supports):
+                    supported.setdefault((x_j, b), []).append((x_i, arc, a))
+
+        while deleted:
+            x_j, b = deleted.popleft()
+            for x_i, arc, a in supported.get((x_j, b), ()):
+                # Values that were deleted already have nothing to update
+                if not assignment[x_i] & a:
+                    continue
+                counter[(arc, a)] -= 1
+                if not counter[(arc, a)] and not delete(x_i, a):
+                    return False
+        return assignment
+
+    def select_unassigned_variable(self, assignment: list[int]) -> int:
         """The function 'Select-Unassigned-Variable' from the pseudocode
-        in the textbook. Should return the name of one of the variables
-        in 'assignment' that have not yet been decided, i.e. whose list
-        of legal values has a length greater than one.
+        in the textbook. Should return the index of one of the variables
+        in 'assignment' that have not yet been decided, i.e. whose
+        bitmask of legal values has more than one bit set. The variable
+        with the fewest legal values left is chosen.
         Parameters
         ----------
-        assignment : dict[list]
-            csp.domains
+        assignment : list[int]
+            csp.domains, encoded as bitmasks by variable index
 
         Returns
         -------
-        str
-            A key to an unassigned variable
+        int
+            The index of an unassigned variable
         """
-        # Find the first (or any) variable with more than 1 value in its domain, return its key
-        return list(filter(lambda key: len(assignment[key]) > 1, assignment.keys()))[0]
+        # Minimum-Remaining-Values: of the variables with more than 1
+        # value in their domain, return the index of the one with the fewest
+        return min((domain.bit_count(), key)
+                   for key, domain in enumerate(assignment)
+                   if domain & (domain - 1))[1]
+
+    def order_domain_values(self, var: int,
+                            assignment: list[int]) -> list[int]:
+        """The function 'Order-Domain-Values' from the pseudocode in the
+        textbook. Orders the values of 'var' by the
+        Least-Constraining-Value heuristic: values that leave the most
+        legal values in the domains of the neighbors of 'var' come
+        first.
 
-    def revise(self, assignment: dict[list[str]], x_i, x_j):
+        Parameters
+        ----------
+        var : int
+            Index of the variable
+        assignment : list[int]
+            csp.domains, encoded as bitmasks by variable index
+
+        Returns
+        -------
+        list[int]
+            The single-bit masks of the values of 'var'
+        """
+        def remaining(value):
+            count = 0
+            for arc in range(self.nbr_ptr[var], self.nbr_ptr[var + 1]):
+                compat = self.arc_compat[arc]
+                if compat is NOT_EQUAL:
+                    supports = ~value
+                else:
+                    supports = compat.get(value, 0)
+                count += (assignment[self.nbr_idx[arc]] & supports).bit_count()
+            return count
+
+        return sorted(bits(assignment[var]), key=remaining, reverse=True)
+
+    def revise(self, assignment: list[int], arc: int,
+               trail: list[tuple] = None):
         """The function 'Revise' from the pseudocode in the textbook.
         'assignment' is the current partial assignment, that contains
-        the lists of legal values for each undecided variable. 'i' and
-        'j' specifies the arc that should be visited. If a value is
-        found in variable i's domain that doesn't satisfy the constraint
-        between i and j, the value should be deleted from i's list of
-        legal values in 'assignment'.
+        the bitmasks of legal values for each undecided variable. 'arc'
+        is the number of the arc (i, j) that should be visited. If a
+        value is found in variable i's domain that doesn't satisfy the
+        constraint between i and j, the value should be deleted from
+        i's bitmask of legal values in 'assignment'.
+
+        The old bitmask of i is appended to 'trail' (if given) when it
+        is revised, so that the change can be undone when backtracking.
         """
-        revised = False
-        for i, x in enumerate(assignment[x_i]):
-            # If the values (x, y) from the domains of x_i and x_j satisfy the constraints, remove x from the domain of x_i
-            if not len(list(filter(lambda y: (x, y) in self.constraints[x_i][x_j], assignment[x_j]))):
-                assignment[x_i].pop(i)
-                revised = True
+        x_i = self.arc_var[arc]
+        x_j = self.nbr_idx[arc]
+        compat = self.arc_compat[arc]
+        domain_i = assignment[x_i]
+        domain_j = assignment[x_j]
+        if compat is NOT_EQUAL:
+            # A value of x_i only loses its support when it is the
+            # single value left for x_j, and every value loses it when
+            # x_j has no values left
+            if not domain_j:
+                revised_domain = 0
+            elif domain_j & (domain_j - 1) == 0:
+                revised_domain = domain_i & ~domain_j
+            else:
+                revised_domain = domain_i
+        else:
+            # Keep only the values x of x_i that have a legal partner y in the domain of x_j
+            revised_domain = 0
+            for x in bits(domain_i):
+                if compat.get(x, 0) & domain_j:
+                    revised_domain |= x
+        revised = revised_domain != domain_i
+        if revised:
+            if trail is not None:
+                trail.append((x_i, domain_i))
+            assignment[x_i] = revised_domain
         return assignment, revised
 
 
@@ -306,28 +785,27 @@ def create_sudoku_csp(filename: str) -> CSP:
         A CSP instance
     """
     csp = CSP()
-    board = list(map(lambda x: x.strip(), open(filename, 'r')))
+    with open(filename, 'r') as file:
+        board = [line.strip() for line in file]
 
+    # Every cell is a variable named by the tuple (row, col)
     for row in range(9):
         for col in range(9):
             if board[row][col] == '0':
-                csp.add_variable('%d-%d' % (row, col), list(map(str,
-                                                                range(1, 10))))
+                csp.add_variable((row, col), SUDOKU_DIGITS)
             else:
-                csp.add_variable('%d-%d' % (row, col), [board[row][col]])
+                csp.add_variable((row, col), [board[row][col]])
 
     for row in range(9):
-        csp.add_all_different_constraint(['%d-%d' % (row, col)
-                                          for col in range(9)])
+        csp.add_all_different_constraint([(row, col) for col in range(9)])
     for col in range(9):
-        csp.add_all_different_constraint(['%d-%d' % (row, col)
-                                         for row in range(9)])
+        csp.add_all_different_constraint([(row, col) for row in range(9)])
     for box_row in range(3):
         for box_col in range(3):
             cells = []
             for row in range(box_row * 3, (box_row + 1) * 3):
                 for col in range(box_col * 3, (box_col + 1) * 3):
-                    cells.append('%d-%d' % (row, col))
+                    cells.append((row, col))
             csp.add_all_different_constraint(cells)
 
     return csp
@@ -340,11 +818,11 @@ def print_sudoku_solution(solution):
     """
     for row in range(9):
         for col in range(9):
-            if(len(solution['%d-%d' % (row, col)]) > 1):
+            if(len(solution[row, col]) > 1):
                 print(' ', end=" ")
 
             else:
-                print(solution['%d-%d' % (row, col)][0], end=" "),
+                print(solution[row, col][0], end=" "),
             if col == 2 or col == 5:
                 print('|', end=" "),
         print("")
@@ -352,12 +830,12 @@ def print_sudoku_solution(solution):
             print('------+-------+------')
 
 
-csp = create_sudoku_csp("veryhard.txt")
-assignment = copy.deepcopy(csp.domains)
-print_sudoku_solution(csp.domains)
+if __name__ == "__main__":
+    csp = create_sudoku_csp("veryhard.txt")
+    print_sudoku_solution(csp.domains)
+
+    print()
+    print_sudoku_solution(csp.backtracking_search())
 
-print()
-print_sudoku_solution(csp.backtracking_search())
-      
-print(backtrack_call_count)
-print(failure_count)
\ No newline at end of file
+    print(csp.backtrack_call_count)
+    print(csp.failure_count)